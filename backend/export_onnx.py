@@ -0,0 +1,64 @@
+from transformers import CLIPModel
+import torch
+import onnx
+import os
+
+MODEL_NAME = "openai/clip-vit-base-patch32"
+ONNX_OUTPUT_FILE_PATH = "models/clip_vision.onnx"
+OPSET_VERSION = 17
+
+class CLIPImageEncoder(torch.nn.Module):
+    # Equivalent of CLIPModel.get_image_features: the vision tower plus the
+    # projection into the shared 512-d embedding space.
+    def __init__(self, model: CLIPModel):
+        super().__init__()
+        self.vision_model = model.vision_model
+        self.visual_projection = model.visual_projection
+
+    def forward(self, pixel_values):
+        pooled_output = self.vision_model(pixel_values=pixel_values).pooler_output
+        return self.visual_projection(pooled_output)
+
+def main():
+    print(f"Loading CLIP model: '{MODEL_NAME}'...")
+    try:
+        model = CLIPModel.from_pretrained(MODEL_NAME)
+        model.eval()
+        print("Model loaded successfully.")
+    except Exception as e:
+        print(f"Error loading model: {e}")
+        return
+
+    os.makedirs(os.path.dirname(ONNX_OUTPUT_FILE_PATH), exist_ok=True)
+    encoder = CLIPImageEncoder(model)
+    dummy_pixel_values = torch.zeros(1, 3, 224, 224)
+
+    print(f"Exporting vision encoder to '{ONNX_OUTPUT_FILE_PATH}'...")
+    torch.onnx.export(
+        encoder,
+        (dummy_pixel_values,),
+        ONNX_OUTPUT_FILE_PATH,
+        input_names=["pixel_values"],
+        output_names=["image_embeds"],
+        opset_version=OPSET_VERSION,
+        dynamic_axes={"pixel_values": {0: "B"}, "image_embeds": {0: "B"}},
+    )
+
+    # Imported here so the export itself only needs torch and onnx.
+    from onnxruntime.tools.symbolic_shape_infer import SymbolicShapeInference
+    from onnxruntime.transformers.float16 import convert_float_to_float16
+
+    print("Inferring static shapes...")
+    onnx_model = onnx.load(ONNX_OUTPUT_FILE_PATH)
+    onnx_model = SymbolicShapeInference.infer_shapes(onnx_model, auto_merge=True)
+
+    # FP16 targets the CUDA execution provider from onnxruntime-gpu; main.py only
+    # picks this graph up automatically when that provider is available.
+    print("Converting weights and activations to FP16...")
+    onnx_model = convert_float_to_float16(onnx_model, keep_io_types=False)
+    onnx.save(onnx_model, ONNX_OUTPUT_FILE_PATH)
+
+    print("Export complete!")
+
+if __name__ == "__main__":
+    main()
@@ -1,55 +1,192 @@
 from fastapi import FastAPI, File, UploadFile, HTTPException
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import ORJSONResponse
 from fastapi.staticfiles import StaticFiles
 from PIL import Image
-from transformers import CLIPProcessor, CLIPModel
-from sklearn.metrics.pairwise import cosine_similarity
+from transformers import CLIPModel
+import numpy as np
 import torch
-import json
+from torchvision.io import ImageReadMode, decode_jpeg, encode_jpeg
+import orjson
 import io
+import os
+import hashlib
+import asyncio
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from collections import OrderedDict
+from preprocess import CLIP_IMAGE_SIZE, clip_transform, load_rgb_image
 from contextlib import asynccontextmanager
 
 # --- Configuration ---
-VECTORS_FILE = "data/product_vectors.json"
+VECTORS_FILE = "data/product_vectors.npy"
+HNSW_INDEX_FILE = "data/product_vectors.hnsw.faiss"
+INT8_INDEX_FILE = "data/product_vectors.sq8.faiss"
+IDS_FILE = "data/ids.json"
 METADATA_FILE = "data/metadata.json"
 MODEL_NAME = "openai/clip-vit-base-patch32"
+# Written by export_onnx.py; both need the packages in requirements-onnx.txt.
+ONNX_MODEL_FILE = "models/clip_vision.onnx"
+# Built from the ONNX export on the target GPU with:
+#   trtexec --onnx=models/clip_vision.onnx --fp16 --saveEngine=models/clip_vision.trt \
+#       --minShapes=pixel_values:1x3x224x224 --optShapes=pixel_values:1x3x224x224 \
+#       --maxShapes=pixel_values:32x3x224x224
+TENSORRT_ENGINE_FILE = "models/clip_vision.trt"
+USE_TENSORRT = os.environ.get("USE_TENSORRT", "0") == "1"
+
+def default_encoder_backend() -> str:
+    # The exported graph is FP16, which only pays off on the CUDA execution provider;
+    # on CPU, ONNX Runtime would insert casts around every op and lose to torch FP32.
+    if not os.path.exists(ONNX_MODEL_FILE) or not torch.cuda.is_available():
+        return "torch"
+    try:
+        import onnxruntime as ort
+    except ImportError:
+        return "torch"
+    return "onnx" if "CUDAExecutionProvider" in ort.get_available_providers() else "torch"
+
+# "tensorrt" runs the engine above, "onnx" the FP16 graph written by export_onnx.py
+# and "torch" the HuggingFace model.
+if USE_TENSORRT:
+    ENCODER_BACKEND = "tensorrt"
+else:
+    ENCODER_BACKEND = os.environ.get("ENCODER_BACKEND") or default_encoder_backend()
+# Opt-in, and only applies to the "torch" backend. Inductor needs a working C++
+# toolchain at runtime; if compilation fails the server falls back to eager mode.
+USE_TORCH_COMPILE = os.environ.get("USE_TORCH_COMPILE", "0") == "1"
+# Replays single-image GPU inference from a captured CUDA graph. Only used by the eager
+# "torch" backend; mode="reduce-overhead" already does this for compiled builds.
+USE_CUDA_GRAPHS = os.environ.get("USE_CUDA_GRAPHS", "1") == "1"
+# "float32" searches the normalised float matrix with one BLAS matmul. The FAISS
+# backends (require faiss-cpu or faiss-gpu) are "int8", an exact scan over 8-bit
+# scalar-quantised codes (4x smaller than float32, slightly lower precision), and
+# "hnsw", an approximate graph index for large catalogs.
+SEARCH_BACKEND = os.environ.get("SEARCH_BACKEND", "float32")
+HNSW_M = 32
+HNSW_EF_CONSTRUCTION = 200
+# Candidate list size per query; FAISS's default of 16 loses recall on large catalogs.
+HNSW_EF_SEARCH = 128
+TOP_K = 10
+EMBEDDING_CACHE_SIZE = 1024
+# Uploads arriving within BATCH_TIMEOUT seconds of each other share one forward pass.
+# A compiled encoder needs static shapes, so its batches are zero-padded up to the
+# next bucket and every bucket is warmed up at startup. Eager torch, ONNX and
+# TensorRT run the real batch size; padding would only add work there.
+BATCH_BUCKETS = (1, 8, 32)
+MAX_BATCH_SIZE = BATCH_BUCKETS[-1]
+BATCH_TIMEOUT = 0.005
 
 # --- Application State ---
 app_state = {
     "model": None,
-    "processor": None,
-    "product_vectors": {},
-    "product_metadata": {},
-    "device": "cuda" if torch.cuda.is_available() else "cpu"
+    "image_encoder": None,
+    "image_encoder_compiled": False,
+    "cuda_graph": None,
+    "cuda_graph_input": None,
+    "cuda_graph_output": None,
+    "ort_session": None,
+    "trt_engine": None,
+    "trt_context": None,
+    "db": None,
+    "index": None,
+    # Structure-of-arrays layout: row i of db, ids[i] and metas[i] describe the same product.
+    "ids": [],
+    "metas": [],
+    # LRU of query embeddings keyed by a BLAKE2b digest of the uploaded bytes.
+    "emb_cache": OrderedDict(),
+    "emb_cache_lock": threading.Lock(),
+    # Every encoder call, warm-up included, runs on this one thread: TensorRT contexts
+    # are not re-entrant, and torch.compile keeps its CUDA-graph state per thread.
+    "encoder_executor": ThreadPoolExecutor(max_workers=1, thread_name_prefix="encoder"),
+    "batch_queue": None,
+    "batch_worker": None,
+    "use_gpu_decode": False,
+    "device": "cuda" if torch.cuda.is_available() else "cpu",
+    # FP16 halves activation bandwidth on GPU; CPU kernels stay in FP32.
+    "dtype": torch.float16 if torch.cuda.is_available() else torch.float32
 }
 
 # --- FastAPI App Initialization ---
-app = FastAPI()
+app = FastAPI(default_response_class=ORJSONResponse)
 
 # --- Lifespan Events (Startup) ---
 @app.on_event("startup")
 async def startup_event():
     print("Server starting up...")
-    print(f"Loading CLIP model: '{MODEL_NAME}'...")
-    app_state["model"] = CLIPModel.from_pretrained(MODEL_NAME)
-    app_state["processor"] = CLIPProcessor.from_pretrained(MODEL_NAME)
-    app_state["model"].to(app_state["device"])
-    print(f"Model loaded successfully on device: {app_state['device']}")
+    # JPEG uploads are decoded with nvJPEG and preprocessed without leaving the GPU.
+    app_state["use_gpu_decode"] = app_state["device"] == "cuda" and ENCODER_BACKEND != "onnx"
+    if ENCODER_BACKEND == "tensorrt":
+        import tensorrt as trt
+        print(f"Loading TensorRT engine: '{TENSORRT_ENGINE_FILE}'...")
+        logger = trt.Logger(trt.Logger.WARNING)
+        with open(TENSORRT_ENGINE_FILE, 'rb') as f, trt.Runtime(logger) as runtime:
+            engine = runtime.deserialize_cuda_engine(f.read())
+        app_state["trt_engine"] = engine
+        app_state["trt_context"] = engine.create_execution_context()
+        print("Model loaded successfully on device: cuda")
+    elif ENCODER_BACKEND == "onnx":
+        import onnxruntime as ort
+        print(f"Loading ONNX vision encoder: '{ONNX_MODEL_FILE}'...")
+        app_state["ort_session"] = ort.InferenceSession(
+            ONNX_MODEL_FILE,
+            providers=["CUDAExecutionProvider", "CPUExecutionProvider"],
+        )
+        print(f"Model loaded successfully with providers: {app_state['ort_session'].get_providers()}")
+    else:
+        print(f"Loading CLIP model: '{MODEL_NAME}'...")
+        model = CLIPModel.from_pretrained(MODEL_NAME)
+        model.to(app_state["device"], app_state["dtype"], memory_format=torch.channels_last).eval()
+        app_state["model"] = model
+        print(f"Model loaded successfully on device: {app_state['device']}")
+
+        app_state["image_encoder"] = model.get_image_features
+        if USE_TORCH_COMPILE:
+            # Compile the method we actually call; torch.compile(model) would only wrap forward().
+            # "reduce-overhead" records CUDA graphs, which buys nothing on CPU.
+            compile_mode = "reduce-overhead" if app_state["device"] == "cuda" else "default"
+            print(f"Compiling image encoder with torch.compile (mode={compile_mode})...")
+            torch._C._jit_set_profiling_executor(False)
+            # One static graph per batch bucket instead of a dynamic-shape recompile.
+            app_state["image_encoder"] = torch.compile(model.get_image_features, mode=compile_mode, fullgraph=False, dynamic=False)
+            app_state["image_encoder_compiled"] = True
 
     print(f"Loading product vectors from '{VECTORS_FILE}'...")
-    with open(VECTORS_FILE, 'r') as f:
-        product_data = json.load(f)
-    app_state["product_vectors"] = {item['id']: item['vector'] for item in product_data}
-    print(f"Loaded {len(app_state['product_vectors'])} product vectors.")
+    # A single (N, 512) float32 matrix of L2-normalised rows (see preprocess.py); row i
+    # belongs to ids[i]. Read-only mapping, so pages are only loaded as searches touch them.
+    app_state["db"] = np.load(VECTORS_FILE, mmap_mode="r")
+    with open(IDS_FILE, 'rb') as f:
+        app_state["ids"] = orjson.loads(f.read())
+    print(f"Loaded {len(app_state['ids'])} product vectors.")
+
+    if SEARCH_BACKEND in ("int8", "hnsw"):
+        app_state["index"] = load_faiss_index(app_state["db"])
+        # The index holds its own copy of the vectors; don't keep the float matrix too.
+        app_state["db"] = None
 
     print(f"Loading product metadata from '{METADATA_FILE}'...")
-    with open(METADATA_FILE, 'r') as f:
-        metadata = json.load(f)
-    app_state["product_metadata"] = {item['id']: item for item in metadata}
-    print(f"Loaded metadata for {len(app_state['product_metadata'])} products.")
+    with open(METADATA_FILE, 'rb') as f:
+        metadata = orjson.loads(f.read())
+    metadata_by_id = {item['id']: item for item in metadata}
+    # Products without metadata keep a None slot so positions stay aligned with db.
+    app_state["metas"] = [metadata_by_id.get(product_id) for product_id in app_state["ids"]]
+    print(f"Loaded metadata for {len(app_state['metas']) - app_state['metas'].count(None)} products.")
+
+    loop = asyncio.get_running_loop()
+    await loop.run_in_executor(app_state["encoder_executor"], warmup_encoder)
+    if app_state["model"] is not None and app_state["device"] == "cuda" and USE_CUDA_GRAPHS and not app_state["image_encoder_compiled"]:
+        await loop.run_in_executor(app_state["encoder_executor"], capture_cuda_graph)
+
+    app_state["batch_queue"] = asyncio.Queue()
+    app_state["batch_worker"] = asyncio.create_task(batch_worker())
     
     print("Startup complete. Server is ready to accept requests.")
 
+@app.on_event("shutdown")
+async def shutdown_event():
+    if app_state["batch_worker"] is not None:
+        app_state["batch_worker"].cancel()
+    app_state["encoder_executor"].shutdown(wait=False)
+
 # --- CORS Middleware Configuration ---
 origins = [
     "http://localhost:5173",
@@ -68,46 +205,266 @@ app.add_middleware(
 app.mount("/data", StaticFiles(directory="data"), name="data")
 
 # --- Helper Functions ---
-def get_image_embedding(image: Image.Image) -> list:
-    model = app_state["model"]
-    processor = app_state["processor"]
+def load_faiss_index(db: np.ndarray):
+    try:
+        import faiss
+    except ImportError:
+        raise RuntimeError(
+            f"SEARCH_BACKEND={SEARCH_BACKEND} requires FAISS. Install it with "
+            "'pip install faiss-cpu' (or faiss-gpu), or use SEARCH_BACKEND=float32."
+        ) from None
+    index_file = HNSW_INDEX_FILE if SEARCH_BACKEND == "hnsw" else INT8_INDEX_FILE
+    # The index is only reused if it was written after the current vector file;
+    # re-running preprocess.py always triggers a rebuild.
+    if os.path.exists(index_file) and os.path.getmtime(index_file) >= os.path.getmtime(VECTORS_FILE):
+        index = faiss.read_index(index_file)
+        print(f"Loaded {SEARCH_BACKEND} index from '{index_file}'.")
+    else:
+        print(f"Building {SEARCH_BACKEND} index over {len(db)} vectors...")
+        vectors = np.ascontiguousarray(db, dtype=np.float32)
+        # Inner product over L2-normalised rows is cosine similarity.
+        if SEARCH_BACKEND == "hnsw":
+            index = faiss.IndexHNSWFlat(db.shape[1], HNSW_M, faiss.METRIC_INNER_PRODUCT)
+            index.hnsw.efConstruction = HNSW_EF_CONSTRUCTION
+        else:
+            # Learns a per-dimension range and stores one byte per component; queries are
+            # scored directly against the codes with SIMD kernels.
+            index = faiss.IndexScalarQuantizer(db.shape[1], faiss.ScalarQuantizer.QT_8bit, faiss.METRIC_INNER_PRODUCT)
+            index.train(vectors)
+        index.add(vectors)
+        faiss.write_index(index, index_file)
+        print(f"Saved {SEARCH_BACKEND} index to '{index_file}'.")
+    if SEARCH_BACKEND == "hnsw":
+        # Applied on every load so HNSW_EF_SEARCH wins over the value saved in the file.
+        index.hnsw.efSearch = HNSW_EF_SEARCH
+    return index
+
+def to_model_input(pixel_values: torch.Tensor) -> torch.Tensor:
+    return pixel_values.to(app_state["device"], app_state["dtype"], memory_format=torch.channels_last)
+
+def encode_pixel_values_tensorrt(pixel_values: torch.Tensor) -> np.ndarray:
+    # The engine's I/O is FP16 (see export_onnx.py); torch owns the device buffers.
+    context = app_state["trt_context"]
+    pixel_values = pixel_values.to("cuda", torch.float16).contiguous()
+    context.set_input_shape("pixel_values", tuple(pixel_values.shape))
+    output = torch.empty(tuple(context.get_tensor_shape("image_embeds")), device="cuda", dtype=torch.float16)
+    context.set_tensor_address("pixel_values", pixel_values.data_ptr())
+    context.set_tensor_address("image_embeds", output.data_ptr())
+    context.execute_async_v3(torch.cuda.current_stream().cuda_stream)
+    return output.float().cpu().numpy()
+
+def encode_pixel_values(pixel_values: torch.Tensor) -> np.ndarray:
+    if app_state["trt_context"] is not None:
+        return encode_pixel_values_tensorrt(pixel_values)
+
+    session = app_state["ort_session"]
+    if session is not None:
+        embedding = session.run(None, {"pixel_values": pixel_values.cpu().numpy().astype(np.float16)})[0]
+        return embedding.astype(np.float32)
+
+    graph = app_state["cuda_graph"]
+    if graph is not None and pixel_values.shape[0] == 1:
+        with torch.inference_mode():
+            app_state["cuda_graph_input"].copy_(pixel_values)
+            graph.replay()
+            return app_state["cuda_graph_output"].float().cpu().numpy()
+
+    image_encoder = app_state["image_encoder"]
     device = app_state["device"]
-    
-    image = image.convert("RGB")
-    inputs = processor(images=image, return_tensors="pt", padding=True)
-    inputs = {k: v.to(device) for k, v in inputs.items()}
-    
-    with torch.no_grad():
-        embedding = model.get_image_features(pixel_values=inputs['pixel_values'])
-    
-    return embedding.cpu().numpy().flatten().tolist()
+    with torch.inference_mode(), torch.autocast(device_type=device, dtype=torch.float16, enabled=device == "cuda"):
+        embedding = image_encoder(pixel_values=to_model_input(pixel_values))
+    return embedding.float().cpu().numpy()
 
-# --- API Endpoints ---
-@app.post("/find-similar-products/")
-async def find_similar_products(file: UploadFile = File(...)):
+def get_pixel_values(image: Image.Image) -> torch.Tensor:
+    return clip_transform(image).unsqueeze(0)
+
+def get_pixel_values_cuda(contents: bytes):
+    # Returns None when the upload is not a JPEG nvJPEG can handle, so the caller falls back to PIL.
+    if not app_state["use_gpu_decode"] or not contents.startswith(b"\xff\xd8\xff"):
+        return None
     try:
-        contents = await file.read()
-        query_image = Image.open(io.BytesIO(contents))
-    except Exception:
-        raise HTTPException(status_code=400, detail="Invalid image file.")
+        raw = torch.frombuffer(bytearray(contents), dtype=torch.uint8)
+        image = decode_jpeg(raw, mode=ImageReadMode.RGB, device="cuda")
+    except RuntimeError:
+        return None
+    return clip_transform(image).unsqueeze(0)
 
-    query_vector = get_image_embedding(query_image)
-    
-    product_ids = list(app_state["product_vectors"].keys())
-    db_vectors = list(app_state["product_vectors"].values())
-    
-    similarities = cosine_similarity([query_vector], db_vectors)[0]
-    
-    results_with_scores = sorted(zip(product_ids, similarities), key=lambda item: item[1], reverse=True)
+def warmup_encoder() -> None:
+    # Pay for compilation, cuDNN/cuBLAS algorithm selection and nvJPEG init before the
+    # first real request does. Compiled graphs can recompile on the second call, so
+    # they get a few passes over every bucket they will be fed.
+    compiled = app_state["image_encoder_compiled"]
+    sizes = BATCH_BUCKETS if compiled else (1,)
+    passes = 3 if compiled else 1
+    print(f"Warming up image encoder for batch sizes {sizes} ({passes} pass(es) each)...")
+    try:
+        for size in sizes:
+            dummy = torch.zeros(size, 3, CLIP_IMAGE_SIZE, CLIP_IMAGE_SIZE)
+            for _ in range(passes):
+                encode_pixel_values(dummy)
+    except Exception as e:
+        # Compilation is lazy, so a missing compiler or an inductor bug surfaces here.
+        if not compiled:
+            raise
+        print(f"WARNING: torch.compile failed ({e}). Falling back to eager mode.")
+        app_state["image_encoder"] = app_state["model"].get_image_features
+        app_state["image_encoder_compiled"] = False
+        encode_pixel_values(torch.zeros(1, 3, CLIP_IMAGE_SIZE, CLIP_IMAGE_SIZE))
+    if app_state["use_gpu_decode"]:
+        jpeg = encode_jpeg(torch.zeros(3, CLIP_IMAGE_SIZE, CLIP_IMAGE_SIZE, dtype=torch.uint8))
+        encode_pixel_values(get_pixel_values_cuda(jpeg.numpy().tobytes()))
+    print("Warm-up complete.")
+
+def capture_cuda_graph() -> None:
+    # The batch-1 input shape is fixed, so the whole encoder can be recorded once and
+    # replayed with a single launch. Inputs are copied into the static buffer.
+    print("Capturing CUDA graph for single-image inference...")
+    model = app_state["model"]
+    static_input = to_model_input(torch.zeros(1, 3, CLIP_IMAGE_SIZE, CLIP_IMAGE_SIZE))
+    with torch.inference_mode():
+        side_stream = torch.cuda.Stream()
+        side_stream.wait_stream(torch.cuda.current_stream())
+        with torch.cuda.stream(side_stream):
+            for _ in range(3):
+                model.get_image_features(pixel_values=static_input)
+        torch.cuda.current_stream().wait_stream(side_stream)
+
+        graph = torch.cuda.CUDAGraph()
+        with torch.cuda.graph(graph):
+            static_output = model.get_image_features(pixel_values=static_input)
+
+    app_state["cuda_graph"] = graph
+    app_state["cuda_graph_input"] = static_input
+    app_state["cuda_graph_output"] = static_output
+    print("CUDA graph captured.")
+
+def get_cached_embedding(key: bytes):
+    cache = app_state["emb_cache"]
+    with app_state["emb_cache_lock"]:
+        embedding = cache.get(key)
+        if embedding is not None:
+            cache.move_to_end(key)
+    return embedding
+
+def cache_embedding(key: bytes, embedding: np.ndarray) -> None:
+    cache = app_state["emb_cache"]
+    with app_state["emb_cache_lock"]:
+        cache[key] = embedding
+        cache.move_to_end(key)
+        if len(cache) > EMBEDDING_CACHE_SIZE:
+            cache.popitem(last=False)
+
+def search_products(query_vector: np.ndarray, k: int) -> tuple[np.ndarray, np.ndarray]:
+    # Returns the row indices of the k best matches and their similarities, best first.
+    index = app_state["index"]
+    if index is not None:
+        query_vector = query_vector / np.linalg.norm(query_vector)
+        scores, idx = index.search(query_vector.reshape(1, -1).astype(np.float32, copy=False), k)
+        # FAISS pads with -1 when the index holds fewer than k vectors.
+        found = idx[0] >= 0
+        return idx[0][found], scores[0][found]
+
+    similarities = compute_similarities(query_vector)
+    idx = top_k_indices(similarities, k)
+    return idx, similarities[idx]
+
+def compute_similarities(query_vector: np.ndarray) -> np.ndarray:
+    query_vector = query_vector / np.linalg.norm(query_vector)
+    return app_state["db"] @ query_vector.astype(np.float32, copy=False)
+
+def top_k_indices(similarities: np.ndarray, k: int) -> np.ndarray:
+    # Partial selection is O(N); only the k survivors get sorted.
+    if k >= len(similarities):
+        return np.argsort(-similarities)
+    idx = np.argpartition(similarities, -k)[-k:]
+    return idx[np.argsort(-similarities[idx])]
+
+def _load_pixel_values(contents: bytes) -> torch.Tensor:
+    pixel_values = get_pixel_values_cuda(contents)
+    if pixel_values is None:
+        try:
+            query_image = load_rgb_image(io.BytesIO(contents))
+        except Exception:
+            raise HTTPException(status_code=400, detail="Invalid image file.")
+        pixel_values = get_pixel_values(query_image)
+    return pixel_values
+
+def _content_key(contents: bytes) -> bytes:
+    return hashlib.blake2b(contents, digest_size=16).digest()
+
+def _pad_to_bucket(pixel_values: torch.Tensor) -> torch.Tensor:
+    size = next(bucket for bucket in BATCH_BUCKETS if bucket >= pixel_values.shape[0])
+    if size == pixel_values.shape[0]:
+        return pixel_values
+    padding = pixel_values.new_zeros((size - pixel_values.shape[0], *pixel_values.shape[1:]))
+    return torch.cat([pixel_values, padding])
+
+def _build_results(query_vector: np.ndarray) -> dict:
+    metas = app_state["metas"]
+    top_indices, top_scores = search_products(query_vector, TOP_K)
     
-    top_results = []
-    for product_id, score in results_with_scores[:10]:
-        product_info = app_state["product_metadata"].get(product_id)
-        if product_info:
-            top_results.append({
-                "product": product_info,
-                "similarity": float(score)
-            })
+    top_results = [
+        {"product": metas[i], "similarity": float(score)}
+        for i, score in zip(top_indices.tolist(), top_scores.tolist())
+        if metas[i] is not None
+    ]
             
     return {"results": top_results}
 
+async def batch_worker() -> None:
+    # Coalesces queued (pixel_values, future) pairs into batches of up to MAX_BATCH_SIZE.
+    queue = app_state["batch_queue"]
+    loop = asyncio.get_running_loop()
+    # nvJPEG-decoded uploads are already on the GPU; everything else is batched on the host.
+    batch_device = app_state["device"] if app_state["use_gpu_decode"] else "cpu"
+    while True:
+        batch = [await queue.get()]
+        deadline = loop.time() + BATCH_TIMEOUT
+        while len(batch) < MAX_BATCH_SIZE:
+            remaining = deadline - loop.time()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(await asyncio.wait_for(queue.get(), remaining))
+            except asyncio.TimeoutError:
+                break
+
+        try:
+            pixel_values = torch.cat([item[0].to(batch_device) for item in batch])
+            if app_state["image_encoder_compiled"]:
+                pixel_values = _pad_to_bucket(pixel_values)
+            embeddings = await loop.run_in_executor(app_state["encoder_executor"], encode_pixel_values, pixel_values)
+        except Exception as e:
+            for _, future in batch:
+                if not future.done():
+                    future.set_exception(e)
+            continue
+        # zip() stops at the real requests and drops any padding rows.
+        for (_, future), embedding in zip(batch, embeddings):
+            if not future.done():
+                # Copy so the embedding cache doesn't pin the whole batch output array.
+                future.set_result(embedding.copy())
+
+# --- API Endpoints ---
+@app.post("/find-similar-products/")
+async def find_similar_products(file: UploadFile = File(...)):
+    contents = await file.read()
+
+    # Hashing, decoding, inference and search are blocking; keep them off the event loop.
+    cache_key = await asyncio.to_thread(_content_key, contents)
+    query_vector = get_cached_embedding(cache_key)
+    if query_vector is None:
+        pixel_values = await asyncio.to_thread(_load_pixel_values, contents)
+        future = asyncio.get_running_loop().create_future()
+        await app_state["batch_queue"].put((pixel_values, future))
+        query_vector = await future
+        cache_embedding(cache_key, query_vector)
+
+    return await asyncio.to_thread(_build_results, query_vector)
+
+if __name__ == "__main__":
+    import uvicorn
+    # uvicorn's "auto" loop/http settings pick uvloop (libuv event loop) and httptools
+    # (C HTTP parser) whenever they are installed, and fall back to asyncio/h11 on
+    # platforms such as Windows where uvloop is unavailable.
+    uvicorn.run("main:app", loop="auto", http="auto")
@@ -1,12 +1,63 @@
-import json
+import orjson
 from PIL import Image
-from transformers import CLIPProcessor, CLIPModel
+from transformers import CLIPModel
+import numpy as np
 import torch
+from torch.utils.data import DataLoader, Dataset
+from torchvision.transforms import v2
 import os
 
 METADATA_FILE_PATH = "data/metadata.json"
-VECTORS_OUTPUT_FILE_PATH = "data/product_vectors.json"
+VECTORS_OUTPUT_FILE_PATH = "data/product_vectors.npy"
+IDS_OUTPUT_FILE_PATH = "data/ids.json"
 MODEL_NAME = "openai/clip-vit-base-patch32"
+BATCH_SIZE = 64
+NUM_WORKERS = 4
+
+# CLIP's fixed vision preprocessing: bicubic resize of the short side, centre crop, normalise.
+# Shared with main.py so product and query embeddings see identical pixels.
+CLIP_IMAGE_SIZE = 224
+CLIP_MEAN = [0.48145466, 0.4578275, 0.40821073]
+CLIP_STD = [0.26862954, 0.26130258, 0.27577711]
+
+# Accepts PIL images as well as uint8 CHW tensors (on any device).
+clip_transform = v2.Compose([
+    v2.Resize(CLIP_IMAGE_SIZE, interpolation=v2.InterpolationMode.BICUBIC, antialias=True),
+    v2.CenterCrop(CLIP_IMAGE_SIZE),
+    v2.ToImage(),
+    v2.ToDtype(torch.float32, scale=True),
+    v2.Normalize(mean=CLIP_MEAN, std=CLIP_STD),
+])
+
+def load_rgb_image(fp):
+    # Full-resolution decode on purpose: every path (this one, uploads and nvJPEG)
+    # must hand clip_transform the same pixels, or queries drift from stored vectors.
+    return Image.open(fp).convert("RGB")
+
+class ProductImageDataset(Dataset):
+    def __init__(self, products):
+        self.products = products
+
+    def __len__(self):
+        return len(self.products)
+
+    def __getitem__(self, index):
+        product = self.products[index]
+        try:
+            image = load_rgb_image(product["image_path"])
+            pixel_values = clip_transform(image)
+        except Exception as e:
+            print(f"ERROR: Failed to process image for product ID '{product.get('id')}'. Error: {e}")
+            return product.get("id"), None
+        return product.get("id"), pixel_values
+
+def collate_products(items):
+    # Unreadable images come back as None and are dropped from the batch.
+    items = [(product_id, pixel_values) for product_id, pixel_values in items if pixel_values is not None]
+    if not items:
+        return [], None
+    product_ids, pixel_values = zip(*items)
+    return list(product_ids), torch.stack(pixel_values)
 
 def main():
     print("Starting image pre-processing...")
@@ -17,22 +68,24 @@ def main():
     print(f"Loading CLIP model: '{MODEL_NAME}'...")
     try:
         model = CLIPModel.from_pretrained(MODEL_NAME)
-        processor = CLIPProcessor.from_pretrained(MODEL_NAME)
         print("Model loaded successfully.")
     except Exception as e:
         print(f"Error loading model: {e}")
         return
 
-    with open(METADATA_FILE_PATH, 'r') as f:
-        products = json.load(f)
+    with open(METADATA_FILE_PATH, 'rb') as f:
+        products = orjson.loads(f.read())
     print(f"Found {len(products)} products in metadata file.")
 
+    product_ids = []
     all_product_vectors = []
     device = "cuda" if torch.cuda.is_available() else "cpu"
     print(f"Using device: {device}")
     model.to(device)
 
-    print("Generating embeddings for each product...")
+    model.eval()
+
+    valid_products = []
     for product in products:
         image_path = product.get("image_path")
         product_id = product.get("id")
@@ -40,33 +93,41 @@ def main():
         if not image_path or not os.path.exists(image_path):
             print(f"WARNING: Image path for product ID '{product_id}' not found at '{image_path}'. Skipping.")
             continue
-        
-        try:
-            image = Image.open(image_path)
-            inputs = processor(text=None, images=image, return_tensors="pt", padding=True)
-            inputs = {k: v.to(device) for k, v in inputs.items()}
-            
-            with torch.no_grad():
-                # --- THIS IS THE FINAL CORRECTED LINE ---
-                image_features = model.get_image_features(pixel_values=inputs['pixel_values'])
-            
-            embedding = image_features.cpu().numpy().flatten().tolist()
-            
-            all_product_vectors.append({
-                "id": product_id,
-                "vector": embedding
-            })
-            print(f"  - Successfully processed product ID: {product_id}")
-        except Exception as e:
-            print(f"ERROR: Failed to process image for product ID '{product_id}'. Error: {e}")
+        valid_products.append(product)
+
+    loader = DataLoader(
+        ProductImageDataset(valid_products),
+        batch_size=BATCH_SIZE,
+        num_workers=NUM_WORKERS,
+        pin_memory=device == "cuda",
+        collate_fn=collate_products,
+    )
+
+    print(f"Generating embeddings in batches of {BATCH_SIZE}...")
+    for batch_ids, pixel_values in loader:
+        if pixel_values is None:
+            continue
+
+        with torch.inference_mode(), torch.autocast(device_type=device, dtype=torch.float16, enabled=device == "cuda"):
+            image_features = model.get_image_features(pixel_values=pixel_values.to(device, non_blocking=True))
+
+        product_ids.extend(batch_ids)
+        all_product_vectors.extend(image_features.float().cpu().numpy())
+        print(f"  - Successfully processed {len(batch_ids)} products (last ID: {batch_ids[-1]})")
 
     if not all_product_vectors:
         print("\nCRITICAL ERROR: No product vectors were generated. Aborting save.")
         return
 
-    print(f"\nSaving {len(all_product_vectors)} generated vectors to '{VECTORS_OUTPUT_FILE_PATH}'...")
-    with open(VECTORS_OUTPUT_FILE_PATH, 'w') as f:
-        json.dump(all_product_vectors, f, indent=4)
+    # Rows of the matrix line up with the entries of the ids file. They are stored
+    # L2-normalised so the server can memory-map the file read-only and search it
+    # with a plain dot product.
+    vectors = np.stack(all_product_vectors)
+    vectors /= np.linalg.norm(vectors, axis=1, keepdims=True)
+    print(f"\nSaving {len(product_ids)} generated vectors to '{VECTORS_OUTPUT_FILE_PATH}'...")
+    np.save(VECTORS_OUTPUT_FILE_PATH, vectors)
+    with open(IDS_OUTPUT_FILE_PATH, 'wb') as f:
+        f.write(orjson.dumps(product_ids, option=orjson.OPT_INDENT_2))
     
     print("Pre-processing complete!")
 